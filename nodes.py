@@ -1,61 +1,191 @@
+import io
 import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Iterable
+from functools import lru_cache
+from itertools import repeat
+from typing import Any, Iterator
 
 import numpy as np
+import torch
 from PIL import Image
 
 import folder_paths
 
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
 
-def _handle_whitespace(text: str) -> str:
-    return text.strip().replace("\n", " ").replace("\r", " ").replace("\t", " ")
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# Pillow releases the GIL while encoding, so images of a batch can be
+# compressed in parallel. Threads are created lazily and reused across saves.
+_ENCODE_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="batch-image-saver")
+
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
 
 
-def _get_timestamp(time_format: str) -> str:
-    now = datetime.now()
+def _write_file(file_path: str, data: bytes) -> None:
+    fd = os.open(file_path, _WRITE_FLAGS, 0o666)
     try:
-        return now.strftime(time_format)
-    except Exception:
-        return now.strftime("%Y-%m-%d-%H%M%S")
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+def _encode_jpeg_with_vips(array) -> bytes:
+    # Images built from raw memory carry no metadata, so nothing needs to be
+    # stripped (and ``strip`` is deprecated in favour of ``keep`` since
+    # libvips 8.15). Chroma subsampling is forced on to match Pillow's 4:2:0
+    # output at quality 95; libvips disables it automatically at that quality.
+    height, width, bands = array.shape
+    image = pyvips.Image.new_from_memory(array, width, height, bands, "uchar")
+    return image.jpegsave_buffer(Q=95, optimize_coding=False, subsample_mode="on")
+
+
+if njit is not None:
+
+    @njit(parallel=True)
+    def _scale_to_uint8(src, dst):
+        # Fused multiply/clamp/cast over the flattened float32 batch. NaN
+        # fails both comparisons and maps to 0.
+        for i in prange(src.shape[0]):
+            value = src[i] * 255.0
+            if value > 255.0:
+                dst[i] = 255
+            elif value > 0.0:
+                dst[i] = np.uint8(value)
+            else:
+                dst[i] = 0
 
+    # JIT compilation takes about a second; do it on a pool thread at load
+    # time so the first CPU save does not pay for it.
+    _ENCODE_EXECUTOR.submit(_scale_to_uint8, np.zeros(1, dtype=np.float32), np.empty(1, dtype=np.uint8))
 
-def _make_pathname(template: str, values: dict[str, Any], time_format: str) -> str:
-    path = template
-    path = path.replace("%date", _get_timestamp("%Y-%m-%d"))
-    path = path.replace("%time", _get_timestamp(time_format))
-    path = path.replace("%model", _handle_whitespace(str(values.get("model", "unknown"))))
-    path = path.replace("%seed", _handle_whitespace(str(values.get("seed", "unknown"))))
-    path = path.replace("%counter", _handle_whitespace(str(values.get("counter", 0))))
-    return path
+else:
+    _scale_to_uint8 = None
 
 
-def _make_filename(template: str, values: dict[str, Any], time_format: str) -> str:
-    filename = _make_pathname(template, values, time_format)
-    return _get_timestamp(time_format) if filename == "" else filename
+def _handle_whitespace(text: str) -> str:
+    return text.strip().replace("\n", " ").replace("\r", " ").replace("\t", " ")
 
 
-def _flatten_dict_items(data: Any) -> Iterable[tuple[str, Any]]:
-    if isinstance(data, dict):
-        for key, value in data.items():
-            yield key, value
-            yield from _flatten_dict_items(value)
-    elif isinstance(data, (list, tuple)):
-        for item in data:
-            yield from _flatten_dict_items(item)
+def _get_timestamp(now: datetime, time_format: str) -> str:
+    try:
+        return now.strftime(time_format)
+    except Exception:
+        return now.strftime("%Y-%m-%d-%H%M%S")
 
 
-def _extract_first_value(data: Any, target_keys: set[str]) -> Any | None:
-    for key, value in _flatten_dict_items(data):
-        if key in target_keys:
-            return value
-    return None
+_TOKEN_PATTERN = re.compile(r"%(date|time|model|seed|counter)")
+
+
+@lru_cache(maxsize=64)
+def _compile_template(template: str) -> tuple[tuple[str, str | None], ...]:
+    # Split the template once into (literal, token) pairs so repeated saves
+    # with the same template never rescan it.
+    parts: list[tuple[str, str | None]] = []
+    position = 0
+    for match in _TOKEN_PATTERN.finditer(template):
+        parts.append((template[position:match.start()], match.group(1)))
+        position = match.end()
+    parts.append((template[position:], None))
+    return tuple(parts)
+
+
+def _resolve_token(token: str, values: dict[str, Any]) -> str:
+    if token == "date" or token == "time":
+        return values[token]
+    if token == "counter":
+        return _handle_whitespace(str(values.get("counter", 0)))
+    return _handle_whitespace(str(values.get(token, "unknown")))
+
+
+def _make_pathname(template: str, values: dict[str, Any]) -> str:
+    if "%" not in template:
+        return template
+    chunks: list[str] = []
+    for literal, token in _compile_template(template):
+        chunks.append(literal)
+        if token is not None:
+            chunks.append(_resolve_token(token, values))
+    return "".join(chunks)
+
+
+def _make_filename(template: str, values: dict[str, Any]) -> str:
+    filename = _make_pathname(template, values)
+    return values["time"] if filename == "" else filename
+
+
+def _extract_metadata(data: Any, include_model_name: bool, found: dict[str, Any]) -> None:
+    # Single iterative pre-order walk over (key, value) pairs that fills the
+    # "model" and "seed" entries of ``found`` still set to None with the
+    # first matching value, and stops once neither is needed. List items
+    # carry no key, so they are paired with None. The key sets are tiny, so
+    # plain comparisons are cheaper than hashing every key for a set lookup.
+    need_model = found["model"] is None
+    need_seed = found["seed"] is None
+    stack: list[Iterator[tuple[Any, Any]]] = [iter(((None, data),))]
+    while stack and (need_model or need_seed):
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            continue
+        key, value = entry
+        if need_model and (
+            key == "model" or key == "ckpt_name" or (include_model_name and key == "model_name")
+        ):
+            found["model"] = value
+            need_model = False
+        elif need_seed and key == "seed":
+            found["seed"] = value
+            need_seed = False
+        if isinstance(value, dict):
+            stack.append(iter(value.items()))
+        elif isinstance(value, (list, tuple)):
+            stack.append(zip(repeat(None), value))
+
+
+_METADATA_CACHE_SIZE = 8
+_CREATED_DIRS_CACHE_SIZE = 8
+_metadata_cache: OrderedDict[tuple[int, int], tuple[Any, Any, dict[str, Any]]] = OrderedDict()
+
+
+def _lookup_metadata(prompt: Any, extra_pnginfo: Any) -> dict[str, Any]:
+    # Repeated saves of the same queue item share their prompt objects, so
+    # the walk result is cached by identity. Entries keep a reference to the
+    # objects they were built from, which stops a recycled id() from matching.
+    cache_key = (id(prompt), id(extra_pnginfo))
+    cached = _metadata_cache.get(cache_key)
+    if cached is not None and cached[0] is prompt and cached[1] is extra_pnginfo:
+        _metadata_cache.move_to_end(cache_key)
+        return cached[2]
+
+    found: dict[str, Any] = {"model": None, "seed": None}
+    if extra_pnginfo is not None:
+        _extract_metadata(extra_pnginfo, True, found)
+    if prompt is not None and (found["model"] is None or found["seed"] is None):
+        _extract_metadata(prompt, False, found)
+
+    _metadata_cache[cache_key] = (prompt, extra_pnginfo, found)
+    if len(_metadata_cache) > _METADATA_CACHE_SIZE:
+        _metadata_cache.popitem(last=False)
+    return found
 
 
 class BatchImageSaver:
     def __init__(self):
         self.output_dir = folder_paths.output_directory
         self._save_counter = 0
+        self._created_dirs: OrderedDict[str, None] = OrderedDict()
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -66,6 +196,9 @@ class BatchImageSaver:
                 "path": ("STRING", {"default": "", "multiline": False}),
                 "extension": (["png", "jpeg", "webp"],),
             },
+            "optional": {
+                "compress_level": ("INT", {"default": 1, "min": 0, "max": 9}),
+            },
             "hidden": {
                 "prompt": "PROMPT",
                 "extra_pnginfo": "EXTRA_PNGINFO",
@@ -77,77 +210,137 @@ class BatchImageSaver:
     OUTPUT_NODE = True
     CATEGORY = "ImageSaverTools"
 
-    def save_images(self, images, filename, path, extension, prompt=None, extra_pnginfo=None):
+    def save_images(self, images, filename, path, extension, compress_level=1, prompt=None, extra_pnginfo=None):
         self._save_counter += 1
 
-        metadata_source = extra_pnginfo if extra_pnginfo is not None else {}
-        model = _extract_first_value(metadata_source, {"model", "model_name", "ckpt_name"})
-        if model is None and prompt is not None:
-            model = _extract_first_value(prompt, {"model", "ckpt_name"})
-
-        seed = _extract_first_value(metadata_source, {"seed"})
-        if seed is None and prompt is not None:
-            seed = _extract_first_value(prompt, {"seed"})
+        found = _lookup_metadata(prompt, extra_pnginfo)
+        model = found["model"]
+        seed = found["seed"]
 
         values = {
             "model": model if model is not None else "unknown",
             "seed": seed if seed is not None else "unknown",
             "counter": self._save_counter,
         }
+        # Format the timestamps once per save so every token in the filename
+        # and path shares the same instant, and skip them entirely when
+        # neither template can use them.
+        if filename == "" or "%" in filename or "%" in path:
+            now = datetime.now()
+            values["date"] = _get_timestamp(now, "%Y-%m-%d")
+            values["time"] = _get_timestamp(now, "%Y-%m-%d-%H%M%S")
 
-        time_format = "%Y-%m-%d-%H%M%S"
-        filename_base = _make_filename(filename, values, time_format)
-        relative_path = _make_pathname(path, values, time_format)
+        filename_base = _make_filename(filename, values)
+        relative_path = _make_pathname(path, values)
 
         output_path = os.path.join(self.output_dir, relative_path)
         if output_path.strip() != "":
-            os.makedirs(output_path, exist_ok=True)
+            self._ensure_directory(output_path)
         else:
             output_path = self.output_dir
 
-        saved_files = self._write_images(images, output_path, filename_base, extension.lower())
-
         subfolder = os.path.normpath(relative_path)
         if subfolder == ".":
             subfolder = ""
 
-        return {
-            "ui": {
-                "images": [
-                    {"filename": name, "subfolder": subfolder, "type": "output"}
-                    for name in saved_files
-                ]
-            }
-        }
-
-    def _write_images(self, images, output_path: str, filename_prefix: str, extension: str) -> list[str]:
-        paths: list[str] = []
+        saved_images = self._write_images(
+            images, output_path, subfolder, filename_base, extension.lower(), compress_level
+        )
+
+        return {"ui": {"images": saved_images}}
+
+    def _ensure_directory(self, output_path: str) -> None:
+        # Remember the directories most recently created by this node so
+        # repeat saves into the same folder skip the makedirs syscalls. The
+        # cache is bounded because templates such as %date/%time render a new
+        # folder on every save.
+        if output_path in self._created_dirs:
+            self._created_dirs.move_to_end(output_path)
+            return
+        os.makedirs(output_path, exist_ok=True)
+        self._created_dirs[output_path] = None
+        if len(self._created_dirs) > _CREATED_DIRS_CACHE_SIZE:
+            self._created_dirs.popitem(last=False)
+
+    @staticmethod
+    def _to_uint8(images):
+        # Clamping before the cast keeps out-of-range values from wrapping
+        # around. The result is C-contiguous, so each ``batch[index]`` handed
+        # to the encoders is a view into one shared buffer rather than a copy.
+        if images.device.type == "cpu" and images.dtype == torch.float32:
+            src = images.contiguous().numpy()
+            if _scale_to_uint8 is not None:
+                # One compiled pass instead of three NumPy passes.
+                batch = np.empty(src.shape, dtype=np.uint8)
+                _scale_to_uint8(src.reshape(-1), batch.reshape(-1))
+                return batch
+            # Scale and clamp in a single scratch buffer, then cast once.
+            scaled = np.multiply(src, 255.0)
+            np.clip(scaled, 0, 255, out=scaled)
+            return scaled.astype(np.uint8)
+        # Anything else (GPU tensors in particular) is scaled, clamped and
+        # cast on its own device so only one byte per channel is copied back
+        # to the host.
+        if images.is_floating_point():
+            images = images.mul(255.0).clamp_(0, 255)
+        return images.to(torch.uint8).contiguous().cpu().numpy()
+
+    def _write_images(
+        self, images, output_path: str, subfolder: str, filename_prefix: str, extension: str, compress_level: int
+    ) -> list[dict[str, str]]:
         batch_size = images.size()[0]
-
-        for index, image in enumerate(images):
-            array = 255.0 * image.cpu().numpy()
-            img = Image.fromarray(np.clip(array, 0, 255).astype(np.uint8))
-
-            if batch_size > 1:
-                current_prefix = f"{filename_prefix}_{index + 1:02d}"
-            else:
-                current_prefix = filename_prefix
-
-            filename = f"{current_prefix}.{extension}"
-            file_path = os.path.join(output_path, filename)
-
-            save_kwargs = {"optimize": True}
-            if extension == "png":
-                save_kwargs["compress_level"] = 4
-            elif extension == "jpeg":
-                save_kwargs["quality"] = 95
-            elif extension == "webp":
-                save_kwargs["quality"] = 95
-
-            img.save(file_path, **save_kwargs)
-            paths.append(filename)
-
-        return paths
+        if batch_size == 0:
+            return []
+
+        batch = self._to_uint8(images)
+
+        # Favour encode speed: PNG's optimize pass and JPEG's optimal-Huffman
+        # pass cost far more time than the few percent of file size they save.
+        # JPEG stays baseline (sequential), since libjpeg re-enables Huffman
+        # optimisation for progressive output.
+        save_kwargs: dict[str, Any] = {}
+        if extension == "png":
+            save_kwargs["compress_level"] = compress_level
+        elif extension == "jpeg":
+            save_kwargs.update(quality=95, optimize=False)
+        elif extension == "webp":
+            save_kwargs["quality"] = 95
+
+        if batch_size > 1:
+            filenames = [f"{filename_prefix}_{index + 1:02d}.{extension}" for index in range(batch_size)]
+        else:
+            filenames = [f"{filename_prefix}.{extension}"]
+        directory = os.path.join(output_path, "")
+        file_paths = [directory + name for name in filenames]
+
+        image_format = extension.upper()
+        # libvips only beats Pillow for JPEG; its WebP encoder is slower.
+        use_vips = pyvips is not None and extension == "jpeg"
+
+        def encode(index: int) -> bytes:
+            if use_vips:
+                return _encode_jpeg_with_vips(batch[index])
+            buffer = io.BytesIO()
+            Image.fromarray(batch[index]).save(buffer, format=image_format, **save_kwargs)
+            return buffer.getvalue()
+
+        # Encode in parallel, then write the finished buffers in one tight
+        # loop with raw file descriptors.
+        encoded = _ENCODE_EXECUTOR.map(encode, range(batch_size))
+        for file_path, data in zip(file_paths, encoded):
+            try:
+                _write_file(file_path, data)
+            except FileNotFoundError:
+                # A cached output directory may have been removed since it was
+                # created; recreate it and retry this write only. Any other
+                # missing directory is reported as before.
+                if output_path not in self._created_dirs or os.path.dirname(file_path) != os.path.dirname(directory):
+                    raise
+                del self._created_dirs[output_path]
+                self._ensure_directory(output_path)
+                _write_file(file_path, data)
+
+        return [{"filename": name, "subfolder": subfolder, "type": "output"} for name in filenames]
 
 
 NODE_CLASS_MAPPINGS = {